@@ -0,0 +1,108 @@
+import io
+import os
+import random
+
+from PIL import Image
+from sqlalchemy import func, insert, select
+
+from website import db, facets
+from website.images import content_hash_name, generate_variants
+from website.models import Book, User
+
+CATEGORIES = ['fiction', 'nonfiction', 'abstract']
+CONDITIONS = ['new', 'old', 'like-new']
+
+WORDS = (
+    'shadow river garden silent empire winter letters midnight stone journey '
+    'house ocean secret light city forest memory island dream history war '
+    'kingdom road fire glass star voice machine mountain lost last little '
+    'modern brief guide art science mind heart world time children'
+).split()
+
+
+def random_title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+
+
+def random_summary(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))).capitalize() + '.'
+
+
+def cover_bytes(rng, width=600, height=900):
+    # A flat-coloured JPEG with some noise, roughly the size of a phone photo
+    image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    image = Image.blend(image, noise, 0.3)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def make_covers(directory, count, rng, variants=True):
+    # Write `count` distinct covers (and their variants) into the upload
+    # folder; returns (filename, photo_variants) pairs
+    covers = []
+    for _ in range(count):
+        data = cover_bytes(rng)
+        filename = content_hash_name(io.BytesIO(data), 'jpg')
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(data)
+        made = ','.join(generate_variants(directory, filename)) if variants else None
+        covers.append((filename, made))
+    return covers
+
+
+def seed_catalogue(app, users, books, covers, password, seed=0, batch_size=5000):
+    """Fill the app's database with a synthetic catalogue.
+
+    Creates `users` sellers sharing `password`, `books` listings spread over
+    the three categories and sellers, and `covers` distinct cover images.
+    Returns the seller emails and the ids of each seller's books.
+    """
+    rng = random.Random(seed)
+    with app.app_context():
+        upload_dir = app.config['UPLOADED_PHOTOS_DEST']
+        cover_files = make_covers(upload_dir, covers, rng) if covers else [(None, None)]
+        # Every seller gets the same password, so hash it once
+        pw_hash = app.extensions['password_hasher'].hash(password)
+
+        emails = [f'seller{i}@example.com' for i in range(users)]
+        db.session.execute(insert(User.__table__), [
+            {'email': email, 'password': pw_hash, 'first_name': f'Seller {i}', 'phone': '9800000000'}
+            for i, email in enumerate(emails)
+        ])
+        user_ids = [row[0] for row in db.session.execute(
+            select(User.id).where(User.email.in_(emails)).order_by(User.id))]
+
+        for start in range(0, books, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, books)):
+                photo, variants = rng.choice(cover_files)
+                rows.append({
+                    'title': random_title(rng),
+                    'author': f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+                    'condition': rng.choice(CONDITIONS),
+                    'address': 'Kathmandu',
+                    'phone': '9800000000',
+                    'price': round(rng.uniform(1, 60), 2),
+                    'summary': random_summary(rng),
+                    'photo': photo,
+                    'photo_variants': variants,
+                    'category': CATEGORIES[i % len(CATEGORIES)],
+                    'user_id': user_ids[i % len(user_ids)],
+                })
+            db.session.execute(insert(Book.__table__), rows)
+            facets.record(rows, 1)
+            db.session.commit()
+
+        books_by_user = {user_id: [] for user_id in user_ids}
+        for book_id, user_id in db.session.execute(select(Book.id, Book.user_id)):
+            books_by_user[user_id].append(book_id)
+        max_id = db.session.execute(select(func.max(Book.id))).scalar() or 0
+
+    return {
+        'sellers': list(zip(user_ids, emails)),
+        'books_by_user': books_by_user,
+        'max_book_id': max_id,
+        'cover_bytes': [cover_bytes(rng) for _ in range(min(covers, 8) or 1)],
+    }
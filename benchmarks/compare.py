@@ -0,0 +1,79 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Exits with status 1 when any operation's p95 latency grew, or overall
+throughput dropped, by more than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return 100 * (new - old) / old
+
+
+def format_change(pct):
+    return '       -' if pct is None else f'{pct:+7.1f}%'
+
+
+def compare(before, after, threshold):
+    regressions = []
+    print(f"{'operation':<12} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'req/s':>17}")
+    for name in sorted(set(before['operations']) | set(after['operations'])):
+        old = before['operations'].get(name)
+        new = after['operations'].get(name)
+        if not old or not new:
+            print(f'{name:<12} only in one run')
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            cells.append(format_change(change(old[key], new[key])))
+        print(f'{name:<12} ' + ' '.join(f'{cell:>17}' for cell in cells))
+
+        p95 = change(old['p95_ms'], new['p95_ms'])
+        if p95 is not None and p95 > threshold:
+            regressions.append(f'{name}: p95 latency {old["p95_ms"]:.1f} -> {new["p95_ms"]:.1f} ms ({p95:+.1f}%)')
+
+    total = change(before['throughput_rps'], after['throughput_rps'])
+    print(f"\ntotal throughput {before['throughput_rps']:.1f} -> {after['throughput_rps']:.1f} req/s "
+          f"({format_change(total).strip()}), peak RSS {before['peak_rss_mb']:.0f} -> {after['peak_rss_mb']:.0f} MB")
+    if total is not None and -total > threshold:
+        regressions.append(f'total throughput dropped {-total:.1f}%')
+
+    if before['meta'] != after['meta']:
+        differing = sorted(k for k in set(before['meta']) | set(after['meta'])
+                           if k not in ('timestamp', 'git_revision')
+                           and before['meta'].get(k) != after['meta'].get(k))
+        if differing:
+            print(f"note: runs used different settings: {', '.join(differing)}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percentage change counted as a regression (default: 10)')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print('\nRegressions:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
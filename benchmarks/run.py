@@ -0,0 +1,274 @@
+"""Load-test the app against a synthetic catalogue.
+
+Seeds a throwaway SQLite database and upload folder, then drives the real app
+through Flask test clients from several threads with a weighted mix of
+login, view_books, upload_book and delete_book requests. Prints latency
+percentiles, throughput and peak memory, and writes them as JSON so two
+runs can be compared with `python -m benchmarks.compare`.
+
+    python -m benchmarks.run --books 50000 --threads 8 --duration 30 --output before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from website import create_app
+
+from .catalogue import CATEGORIES, CONDITIONS, seed_catalogue
+
+PASSWORD = 'benchmark-password'
+
+DEFAULT_MIX = {'view_books': 80, 'login': 5, 'upload_book': 10, 'delete_book': 5}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}')
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Worker(threading.Thread):
+    # One simulated seller: logs in once, then issues requests from the mix
+    # until the deadline
+    def __init__(self, app, email, own_books, catalogue, mix, deadline, seed):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.email = email
+        self.own_books = own_books
+        self.catalogue = catalogue
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.skipped = 0
+
+    def login(self):
+        response = self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+        return response.status_code == 302 and response.location.endswith('/public-home')
+
+    def view_books(self):
+        category = self.rng.choice(CATEGORIES)
+        url = f'/books/{category}'
+        # Most visitors look at the first page; the rest jump somewhere deeper
+        params = []
+        if self.rng.random() < 0.3:
+            params.append(f"after={self.rng.randint(1, self.catalogue['max_book_id'])}")
+        # and some narrow the page down by condition
+        if self.rng.random() < 0.2:
+            params.append(f'condition={self.rng.choice(CONDITIONS)}')
+        if params:
+            url += '?' + '&'.join(params)
+        return self.client.get(url).status_code == 200
+
+    def upload_book(self):
+        # Trailing bytes after the JPEG end marker make every upload unique,
+        # so the content-hash store and image pipeline do real work
+        data = self.rng.choice(self.catalogue['cover_bytes']) + os.urandom(16)
+        response = self.client.post('/upload_book', content_type='multipart/form-data', data={
+            'book_name': 'Benchmark listing',
+            'author': 'Load Test',
+            'condition': self.rng.choice(CONDITIONS),
+            'address': 'Kathmandu',
+            'phone': '9800000000',
+            'price': str(self.rng.randint(1, 60)),
+            'summary': 'Uploaded by the benchmark suite.',
+            'category': self.rng.choice(CATEGORIES),
+            'photo': (io.BytesIO(data), 'cover.jpg'),
+        })
+        return response.status_code == 302 and '/books/' in response.location
+
+    def delete_book(self):
+        if not self.own_books:
+            return None
+        book_id = self.own_books.pop()
+        return self.client.post(f'/delete_book/{book_id}').status_code == 302
+
+    def run(self):
+        self.login()
+        while time.perf_counter() < self.deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(self, name)()
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok is None:
+                self.skipped += 1
+                continue
+            self.latencies[name].append(elapsed)
+            if not ok:
+                self.errors[name] += 1
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='thriftbook-bench-')
+    upload_dir = os.path.join(workdir, 'images')
+    os.makedirs(upload_dir)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'UPLOADED_PHOTOS_DEST': upload_dir,
+        'BCRYPT_LOG_ROUNDS': args.bcrypt_rounds,
+        'CACHE_BACKEND': args.cache_backend,
+        'SQLITE_PROFILE': args.sqlite_profile,
+        'DB_AUTO_UPGRADE': True,
+    })
+
+    try:
+        print(f'Seeding {args.users} sellers, {args.books} books and {args.covers} covers in {workdir} ...')
+        started = time.perf_counter()
+        catalogue = seed_catalogue(app, args.users, args.books, args.covers, PASSWORD, seed=args.seed)
+        seed_seconds = time.perf_counter() - started
+
+        sellers = catalogue['sellers']
+        deadline = time.perf_counter() + args.duration
+        workers = []
+        for i in range(args.threads):
+            user_id, email = sellers[i % len(sellers)]
+            # Threads that share a seller split that seller's books between them
+            sharing = len(range(i % len(sellers), args.threads, len(sellers)))
+            own = catalogue['books_by_user'][user_id][i // len(sellers)::sharing]
+            workers.append(Worker(app, email, list(own), catalogue, args.mix, deadline, args.seed + i))
+
+        print(f'Running {args.threads} threads for {args.duration}s ...')
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        # Let queued image resizing finish so its memory is counted
+        app.extensions['image_pipeline'].shutdown(wait=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    operations = {}
+    total = 0
+    for name in args.mix:
+        samples = sorted(s for worker in workers for s in worker.latencies[name])
+        errors = sum(worker.errors[name] for worker in workers)
+        total += len(samples)
+        operations[name] = {
+            'count': len(samples),
+            'errors': errors,
+            'throughput_rps': len(samples) / elapsed,
+            'mean_ms': 1000 * sum(samples) / len(samples) if samples else None,
+            'p50_ms': 1000 * percentile(samples, 50) if samples else None,
+            'p95_ms': 1000 * percentile(samples, 95) if samples else None,
+            'p99_ms': 1000 * percentile(samples, 99) if samples else None,
+        }
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'users': args.users,
+            'books': args.books,
+            'covers': args.covers,
+            'threads': args.threads,
+            'duration_s': args.duration,
+            'mix': args.mix,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'cache_backend': args.cache_backend,
+            'sqlite_profile': args.sqlite_profile,
+            'seed': args.seed,
+        },
+        'seed_seconds': seed_seconds,
+        'elapsed_s': elapsed,
+        'requests': total,
+        'throughput_rps': total / elapsed,
+        'skipped': sum(worker.skipped for worker in workers),
+        'peak_rss_mb': peak_rss_mb(),
+        'operations': operations,
+    }
+
+
+def format_ms(value):
+    return f'{value:8.1f}' if value is not None else '       -'
+
+
+def print_report(result):
+    print()
+    print(f"{'operation':<12} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, op in result['operations'].items():
+        print(f"{name:<12} {op['count']:>7} {op['errors']:>6} {op['throughput_rps']:>8.1f} "
+              f"{format_ms(op['p50_ms'])} {format_ms(op['p95_ms'])} {format_ms(op['p99_ms'])}")
+    print()
+    print(f"total: {result['requests']} requests in {result['elapsed_s']:.1f}s "
+          f"({result['throughput_rps']:.1f} req/s), peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=20, help='sellers to create (default: 20)')
+    parser.add_argument('--books', type=int, default=20000, help='listings to create (default: 20000)')
+    parser.add_argument('--covers', type=int, default=20, help='distinct cover images (default: 20)')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load (default: 20)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='operation weights, e.g. view_books=80,login=5,upload_book=10,delete_book=5')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='bcrypt cost (default: 12)')
+    parser.add_argument('--cache-backend', default='lru', choices=['lru', 'null', 'redis'])
+    parser.add_argument('--sqlite-profile', default='production', choices=['production', 'default'])
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the catalogue and request mix')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary database and images')
+    args = parser.parse_args(argv)
+
+    if args.users < 1 or args.threads < 1:
+        parser.error('--users and --threads must be at least 1')
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
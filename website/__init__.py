@@ -7,20 +7,42 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 
 db = SQLAlchemy()
+migrate = Migrate()
 DB_NAME = "database.db"
 
 
-def create_app():
+def create_app(config=None):
+    # `config` overrides any of the settings below (used by the benchmarks)
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'hjshjhdjah kjshkjdhjs'
     app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
     app.config["UPLOADED_PHOTOS_DEST"] = os.path.join(os.getcwd(), "website", "static", "images")
-    upload_dir = os.path.join(app.root_path, app.config['UPLOADED_PHOTOS_DEST'])
     app.config['UPLOAD_FOLDER'] = 'website/static/images'
+    app.config['BOOKS_PER_PAGE'] = int(os.environ.get('BOOKS_PER_PAGE', 24))
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'lru')
+    app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['HASHING_EXECUTOR'] = os.environ.get('HASHING_EXECUTOR', 'thread')
+    app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
+    app.config['DB_AUTO_UPGRADE'] = os.environ.get('DB_AUTO_UPGRADE', '1') == '1'
+    app.config['INSTRUMENTATION_ENABLED'] = os.environ.get('INSTRUMENTATION_ENABLED', '0') == '1'
+    if config:
+        app.config.update(config)
+    upload_dir = os.path.join(app.root_path, app.config['UPLOADED_PHOTOS_DEST'])
     os.makedirs(upload_dir, exist_ok=True)
 
-    
+    from . import engine
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine.engine_options(app.config)
+
     db.init_app(app)
+    migrate.init_app(app, db, directory=os.path.join(app.root_path, 'migrations'),
+                     render_as_batch=True, include_name=engine.include_in_migrations)
+
+    from . import images, cache, hashing, assets
+    assets.init_app(app)
+    images.init_app(app)
+    cache.init_app(app)
+    hashing.init_app(app)
 
 
     from .auth import auth
@@ -28,11 +50,22 @@ def create_app():
   
     app.register_blueprint(auth, url_prefix='/')
 
-    from .models import User, Note
+    from .models import User, Note, Book
 
 
     with app.app_context():
-        db.create_all()
+        engine.init_app(app)
+        # Schema changes ship as migrations; run `flask db upgrade` on deploy
+        # and set DB_AUTO_UPGRADE=0 when several processes share the database
+        if app.config['DB_AUTO_UPGRADE']:
+            engine.upgrade_database()
+
+        from . import search, facets, jobs, catalogue, instrumentation
+        search.init_app(app)
+        facets.init_app(app)
+        jobs.init_app(app)
+        catalogue.init_app(app)
+        instrumentation.init_app(app)
 
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
@@ -40,7 +73,7 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return cache.load_cached_user(int(id))
 
     return app
 
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are built without it
+    brotli = None
+
+# Uploads are stored as <sha256 prefix>.<ext> and their resized copies as
+# <sha256 prefix>_<variant>.<ext>, so the name already pins the content
+CONTENT_ADDRESSED_RE = re.compile(r'^[0-9a-f]{32}(_[a-z]+)?\.[a-z0-9]+$')
+
+# Text assets worth shipping precompressed; fonts compress well too
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.ttf', '.otf'}
+
+# Served encodings in order of preference: (Accept-Encoding token, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age={}, immutable'
+
+
+class Fingerprints:
+    # Content hashes of static files, recomputed only when a file's size or
+    # mtime changes, so most lookups are a single stat()
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()[:16]
+        with self._lock:
+            self._hashes[path] = (key, value)
+        return value
+
+
+def is_content_addressed(filename):
+    return bool(CONTENT_ADDRESSED_RE.match(os.path.basename(filename)))
+
+
+def static_path(filename):
+    path = safe_join(current_app.static_folder, filename)
+    return path if path and os.path.isfile(path) else None
+
+
+def fingerprint(filename):
+    if is_content_addressed(filename):
+        return os.path.basename(filename).split('.', 1)[0]
+    path = static_path(filename)
+    return current_app.extensions['static_fingerprints'].get(path) if path else None
+
+
+def add_static_fingerprint(endpoint, values):
+    # url_for('static', filename=...) gets ?v=<content hash> appended, so a
+    # changed file always gets a new URL and old ones can be cached forever.
+    # Content-addressed uploads already have a unique name.
+    if endpoint != 'static' or 'v' in values:
+        return
+    filename = values.get('filename')
+    if filename and not is_content_addressed(filename):
+        version = fingerprint(filename)
+        if version:
+            values['v'] = version
+
+
+def is_fresh(source, copy):
+    # A precompressed copy is only valid if it was built after the source
+    # last changed (the same rule compress_file uses to skip rebuilding)
+    try:
+        return os.path.getmtime(copy) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def pick_encoding(filename):
+    # The best up-to-date precompressed copy of `filename` that the client
+    # accepts; a stale copy is ignored and the plain file served instead
+    if os.path.splitext(filename)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+        return None, None
+    source = static_path(filename)
+    for token, suffix in ENCODINGS:
+        if not request.accept_encodings[token]:
+            continue
+        copy = static_path(filename + suffix)
+        if copy and is_fresh(source, copy):
+            return token, suffix
+    return None, None
+
+
+def serve_static(filename):
+    # Replaces Flask's static view: strong content ETags with If-None-Match
+    # handling, far-future caching for fingerprinted or content-addressed
+    # URLs, and precompressed .br/.gz copies when the client accepts them
+    app = current_app
+    path = static_path(filename)
+    if path is None:
+        raise NotFound()
+
+    etag = fingerprint(filename)
+    encoding, suffix = pick_encoding(filename)
+    served = filename + suffix if encoding else filename
+    if encoding:
+        # Each representation needs its own strong ETag
+        etag = f'{etag}-{encoding}'
+
+    response = send_from_directory(
+        app.static_folder, served,
+        mimetype=mimetypes.guess_type(filename)[0],
+        etag=etag,
+        conditional=True,
+    )
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        response.vary.add('Accept-Encoding')
+
+    version = request.args.get('v')
+    if is_content_addressed(filename) or (version and version == fingerprint(filename)):
+        response.headers['Cache-Control'] = IMMUTABLE.format(app.config['STATIC_MAX_AGE'])
+    else:
+        # Unversioned URL (e.g. a url() inside style.css): always revalidate,
+        # which costs a 304 with no body while the file is unchanged
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def compress_file(path, force=False):
+    # Write path.gz (and path.br with brotli installed) next to the file
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    outputs = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        outputs.append(('.br', lambda d: brotli.compress(d, quality=11)))
+
+    for suffix, compress in outputs:
+        target = path + suffix
+        if not force and is_fresh(path, target):
+            continue
+        compressed = compress(data)
+        # Not worth serving if it barely shrinks
+        if len(compressed) >= len(data) * 0.95:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written.append(target)
+    return written
+
+
+@click.command('compress-static')
+@with_appcontext
+@click.option('--force', is_flag=True, help='Rebuild files that are already up to date.')
+def compress_static_command(force):
+    """Build precompressed .gz/.br copies of the static text assets."""
+    static_folder = current_app.static_folder
+    count = 0
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                count += len(compress_file(os.path.join(root, name), force))
+    click.echo(f'Wrote {count} compressed files.')
+    if brotli is None:
+        click.echo('brotli is not installed; only gzip copies were built.')
+
+
+def init_app(app):
+    app.config.setdefault('STATIC_MAX_AGE', 365 * 24 * 3600)
+    app.extensions['static_fingerprints'] = Fingerprints()
+    app.url_defaults(add_static_fingerprint)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(compress_static_command)
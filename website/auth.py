@@ -1,22 +1,28 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort  # Make sure you import the User model
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app, jsonify  # Make sure you import the User model
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from .models import User, Book
 from . import db 
+from .pagination import KeysetPage, keyset_paginate, parse_cursor
+from .cache import get_cache, invalidate_user
+from .hashing import get_hasher, HashingBusy
+from .search import search_books
+from . import facets, jobs
+from .images import store_upload, process_in_background, image_url
 from flask_login import login_user, login_required, logout_user, current_user
 from passlib.hash import sha256_crypt
-from flask_bcrypt import Bcrypt
-import os
 
-bcrypt = Bcrypt()
 auth = Blueprint('auth', __name__)
 
 UPLOAD_FOLDER = 'website/static/images'  # Specify the folder where uploads will be stored
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
+VALID_CATEGORIES = ['fiction', 'nonfiction', 'abstract']
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower()
+
 @auth.route('/')
 def default():
     return redirect(url_for('auth.public_home'))
@@ -24,7 +30,8 @@ def default():
 @auth.route('/public-home')
 @login_required
 def public_home():
-    return render_template('public_home.html', user=current_user)
+    totals = facets.category_totals(VALID_CATEGORIES)
+    return render_template('public_home.html', user=current_user, totals=totals)
 
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
@@ -33,8 +40,23 @@ def login():
         password = request.form.get('password')
 
         user = User.query.filter_by(email=email).first()
+        hasher = get_hasher()
         if user:
-            if bcrypt.check_password_hash(user.password, password):
+            try:
+                password_ok = hasher.check(user.password, password)
+            except HashingBusy:
+                flash('Too many sign-ins right now, please try again in a moment.', category='error')
+                return render_template("login.html", user=current_user)
+
+            if password_ok:
+                # Upgrade the stored hash if the bcrypt cost has changed
+                if hasher.needs_rehash(user.password):
+                    try:
+                        user.password = hasher.hash(password)
+                        db.session.commit()
+                    except HashingBusy:
+                        pass  # Try again on the next login
+
                 flash('Logged in successfully!', category='success')
                 login_user(user, remember=True)
                 return redirect(url_for('auth.public_home'))
@@ -70,7 +92,11 @@ def sign_up():
         # Validate other fields...
 
         # Hash the password
-        hashed_password = bcrypt.generate_password_hash(password1).decode('utf-8')
+        try:
+            hashed_password = get_hasher().hash(password1)
+        except HashingBusy:
+            flash('Too many sign-ups right now, please try again in a moment.', category='error')
+            return redirect(url_for('auth.sign_up'))
 
         # Save additional user details
         new_user = User(
@@ -83,17 +109,17 @@ def sign_up():
 
         # Save the user's photo if it exists and is valid
         if photo and allowed_file(photo.filename):
-          filename = secure_filename(photo.filename)
-          user_specified_directory = request.form.get('upload_directory')  # Assuming you have a form field for this
-          photo_path = os.path.join(user_specified_directory, filename)
-          photo.save(photo_path)
-          new_user.photo = filename
+          new_user.photo = store_upload(photo, file_extension(photo.filename))
         elif photo:
           flash('Invalid file type. Please upload a valid image.', category='error')
 
         db.session.add(new_user)
         db.session.commit()
 
+        # Resize the photo off the request path
+        if new_user.photo:
+            process_in_background(new_user.photo)
+
         flash('Account created successfully!', category='success')
         return redirect(url_for('auth.login'))
 
@@ -107,7 +133,7 @@ def account():
         'first_name': current_user.first_name,
         'phone': current_user.phone,
         'citizenship': current_user.citizenship,
-         'photo': url_for('static', filename=f'images/{current_user.photo}') if current_user.photo else None, # Assuming you stored the photo path in the database
+         'photo': image_url(current_user.photo, 'card', variants=current_user.photo_variants) if current_user.photo else None,
     }
     return render_template('account.html', user=user_data)
 
@@ -120,11 +146,14 @@ def delete_account():
     user = User.query.get(user_id)
 
     if user:
-        # You might want to add additional cleanup tasks here, such as deleting associated data
-        db.session.delete(user)
+        # The account goes now so it can't be used again; its listings, notes
+        # and images are removed in batches by a background job
+        User.query.filter_by(id=user_id).delete()
+        jobs.enqueue('delete_account', key=f'delete_account:{user_id}', user_id=user_id, photo=user.photo)
         db.session.commit()
+        invalidate_user(user_id)
 
-        flash('Your account has been deleted successfully.', category='success')
+        flash('Your account has been deleted successfully. Your listings will be removed shortly.', category='success')
         return redirect(url_for('auth.login'))
     else:
         flash('Failed to delete account. Please try again.', category='error')
@@ -134,17 +163,67 @@ def delete_account():
 @auth.route('/books/<category>')
 @login_required
 def view_books(category):
-    # Fetch and display books based on the category
-    books = Book.query.filter_by(category=category).all()
-
     # Check if the category is valid, otherwise, return a 404 error
-    valid_categories = ['fiction', 'nonfiction', 'abstract']
-    if category not in valid_categories:
+    if category not in VALID_CATEGORIES:
         abort(404)
-        
-    print(f'Category: {category}, Number of Books: {len(books)}')    
 
-    return render_template(f'{category}.html', books=books, user=current_user)
+    cache = get_cache()
+    after = parse_cursor(request.args.get('after'))
+    before = parse_cursor(request.args.get('before'))
+    per_page = current_app.config['BOOKS_PER_PAGE']
+    filters = facets.parse_filters(request.args)
+    filter_key = facets.filter_key(filters)
+
+    # Fetch one page of books, using the last/first id seen as the cursor
+    def fetch_page():
+        query = facets.apply_filters(Book.query.filter_by(category=category), filters)
+        page = keyset_paginate(query, Book.id, per_page, after=after, before=before)
+        return page.to_dict(Book.to_listing)
+
+    page = KeysetPage.from_dict(
+        cache.get_or_set(cache.key(category, 'page', after, before, per_page, filter_key), fetch_page))
+    panel = cache.get_or_set(cache.key(category, 'facets'), lambda: facets.facet_panel(category))
+
+    # The rendered listing is shared by everyone who owns none of the books
+    # on the page; sellers get their own copy with the delete buttons.
+    owner = current_user.id if any(book['user_id'] == current_user.id for book in page.items) else '-'
+    listing = cache.get_or_set(
+        cache.key(category, 'html', after, before, per_page, filter_key, owner),
+        lambda: render_template('book_list.html', books=page.items, page=page, category=category,
+                                filters=filters, facets=panel),
+    )
+
+    return render_template(f'{category}.html', listing=listing, user=current_user)
+
+
+@auth.route('/cache-stats')
+@login_required
+def cache_stats():
+    return jsonify(get_cache().stats())
+
+
+@auth.route('/job-stats')
+@login_required
+def job_stats():
+    return jsonify(jobs.queue_stats())
+
+
+@auth.route('/search')
+@login_required
+def search():
+    q = request.args.get('q', '').strip()
+    category = request.args.get('category') or None
+    if category is not None and category not in VALID_CATEGORIES:
+        abort(404)
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        page = 1
+
+    books, has_next = search_books(q, category=category, page=page,
+                                   per_page=current_app.config['BOOKS_PER_PAGE'])
+
+    return render_template('search.html', books=books, q=q, category=category,
+                           page=page, has_next=has_next, user=current_user)
 
 
 @auth.route('/upload_book', methods=['GET', 'POST'])
@@ -172,10 +251,7 @@ def upload_book():
             return redirect(request.url)
 
         if book_photo and allowed_file(book_photo.filename):
-            filename = secure_filename(book_photo.filename)
-            photo_path = os.path.join(UPLOAD_FOLDER, filename)
-
-            book_photo.save(photo_path)
+            filename = store_upload(book_photo, file_extension(book_photo.filename))
 
             # Save book details to the database
             new_book = Book(
@@ -192,7 +268,12 @@ def upload_book():
             )
 
             db.session.add(new_book)
+            facets.record([new_book], 1)
             db.session.commit()
+            get_cache().invalidate_category(category)
+
+            # Resize the photo off the request path
+            process_in_background(filename)
 
             flash('Book uploaded successfully!', category='success')
             return redirect(url_for('auth.view_books', category=category))
@@ -209,16 +290,15 @@ def delete_book(book_id):
 
     # Check if the user is the owner of the book
     if current_user.id == book.user_id:
-        try:
-            # Delete the book photo file
-            photo_path = os.path.join('website', 'static', 'images', book.photo)
-            os.remove(photo_path)
-        except FileNotFoundError:
-            pass  # Ignore if the file is not found
-
-        # Delete the book from the database
-        db.session.delete(book)
+        # Delete the book from the database. A second, overlapping request
+        # (a double-clicked button) finds it gone and changes nothing.
+        deleted = facets.delete_books([book])
+        # The photo and its variants are deleted off the request path, unless
+        # another listing shares them
+        if deleted and book.photo:
+            jobs.enqueue('release_images', filenames=[book.photo])
         db.session.commit()
+        get_cache().invalidate_category(book.category)
 
         flash('Book deleted successfully!', category='success')
     else:
@@ -227,3 +307,21 @@ def delete_book(book_id):
     return redirect(url_for('auth.view_books', category=book.category))
 
 
+@auth.route('/delete_books', methods=['POST'])
+@login_required
+def delete_books():
+    # Remove several of the seller's listings at once. The job only deletes
+    # books that belong to the seller, so the ids aren't checked here.
+    book_ids = request.form.getlist('book_id', type=int)
+    category = request.form.get('category')
+
+    if book_ids:
+        jobs.enqueue('delete_books', user_id=current_user.id, book_ids=book_ids)
+        db.session.commit()
+        flash(f'{len(book_ids)} listing(s) will be removed shortly.', category='success')
+    else:
+        flash('No books selected.', category='error')
+
+    if category in VALID_CATEGORIES:
+        return redirect(url_for('auth.view_books', category=category))
+    return redirect(url_for('auth.public_home'))
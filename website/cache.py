@@ -0,0 +1,253 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+
+
+class LRUBackend:
+    # In-process cache: least recently used entries are evicted once
+    # `max_entries` is reached, and entries expire after their TTL. Counters
+    # live outside the LRU so a generation number is never evicted.
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+
+class RedisBackend:
+    # Shared cache for several app processes. Needs the optional `redis`
+    # package; values are stored as JSON.
+    def __init__(self, url, prefix='thriftbook:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND is "redis" but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class NullBackend:
+    # Caching switched off: every lookup is a miss
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class BackendGenerations:
+    # Category generation numbers kept in the cache backend itself. Only
+    # right when every process shares that backend (redis), or when nothing
+    # is cached at all (null).
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, category):
+        return self.backend.get(f'gen:{category}') or 0
+
+    def incr(self, category):
+        self.backend.incr(f'gen:{category}')
+
+
+class DatabaseGenerations:
+    # Category generation numbers in the app database (cache_generation), so
+    # a bump made by any process, web or `flask jobs work`, reaches every
+    # process's in-process LRU. Costs one primary-key lookup per request; the
+    # value is remembered for the rest of the request.
+    def get(self, category):
+        from . import db
+        from .models import CacheGeneration
+
+        memo = g.setdefault('_cache_generations', {}) if has_request_context() else {}
+        if category not in memo:
+            memo[category] = (db.session.query(CacheGeneration.generation)
+                              .filter_by(category=category).scalar() or 0)
+        return memo[category]
+
+    def incr(self, category):
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        from . import db
+        from .models import CacheGeneration
+
+        table = CacheGeneration.__table__
+        upsert = sqlite_insert(table).values(category=category, generation=1)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.category],
+            set_={'generation': table.c.generation + 1},
+        )
+        db.session.execute(upsert)
+        db.session.commit()
+        if has_request_context():
+            g.pop('_cache_generations', None)
+
+
+class Cache:
+    # Listing cache with per-category invalidation. Every key embeds the
+    # category's generation number; bumping it on a write makes all older
+    # entries for that category unreachable, and they age out of the backend.
+    def __init__(self, backend, default_ttl=60, generations=None):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.generations = generations or BackendGenerations(backend)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _generation(self, category):
+        return self.generations.get(category)
+
+    def key(self, category, *parts):
+        return ':'.join(['books', category, str(self._generation(category))] + [str(p) for p in parts])
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl or self.default_ttl)
+
+    def get_or_set(self, key, create, ttl=None):
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate_category(self, category):
+        self.generations.incr(category)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def init_app(app):
+    app.config.setdefault('CACHE_BACKEND', 'lru')
+    app.config.setdefault('CACHE_DEFAULT_TTL', 60)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+    backend_name = app.config['CACHE_BACKEND']
+    generations = None
+    if backend_name == 'lru':
+        backend = LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+        # Each process has its own LRU, but writes happen in all of them
+        # (and in job workers), so invalidations go through the database
+        generations = DatabaseGenerations()
+    elif backend_name == 'redis':
+        backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+    elif backend_name in ('null', None):
+        backend = NullBackend()
+    else:
+        raise ValueError(f'Unknown CACHE_BACKEND: {backend_name!r}')
+
+    app.extensions['cache'] = Cache(backend, app.config['CACHE_DEFAULT_TTL'], generations)
+
+    app.config.setdefault('USER_CACHE_TTL', 30)
+    app.config.setdefault('USER_CACHE_MAX_ENTRIES', 4096)
+    app.extensions['user_cache'] = LRUBackend(app.config['USER_CACHE_MAX_ENTRIES'])
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+def load_cached_user(user_id):
+    # Per-process cache for the login manager's user loader, so authenticated
+    # page views don't look the user up on every request. Entries live for
+    # USER_CACHE_TTL seconds; that is also how long another process may keep
+    # serving a user that was just changed or deleted.
+    from . import db
+    from .models import User
+
+    users = current_app.extensions['user_cache']
+    user = users.get(user_id)
+    if user is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        # Detach it with its columns loaded so it can be shared by later
+        # requests without touching their sessions
+        db.session.expunge(user)
+        users.set(user_id, user, current_app.config['USER_CACHE_TTL'])
+    return user
+
+
+def invalidate_user(user_id):
+    current_app.extensions['user_cache'].delete(user_id)
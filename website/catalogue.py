@@ -0,0 +1,391 @@
+import csv
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db, facets
+from .images import content_hash_name, generate_variants, temp_path
+
+catalogue_cli = AppGroup('catalogue', help='Bulk import and export of books and users.')
+
+VALID_CATEGORIES = ('fiction', 'nonfiction', 'abstract')
+
+
+def init_app(app):
+    app.cli.add_command(catalogue_cli)
+
+
+def models():
+    from .models import Book, User
+    return {'books': Book, 'users': User}
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        return 'jsonl'
+    if path.endswith('.csv'):
+        return 'csv'
+    raise click.UsageError(f'Cannot tell the format of {path}; pass --format csv or --format jsonl.')
+
+
+def read_rows(fh, fmt):
+    # Yields (row_number, row) one at a time, so memory use doesn't depend on
+    # the size of the file
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(fh), start=1):
+            yield number, row
+    else:
+        for number, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f'invalid JSON: {e}')
+                continue
+            if isinstance(row, dict):
+                yield number, row
+            else:
+                yield number, ValueError('expected a JSON object')
+
+
+def batches(rows, size):
+    batch = []
+    for item in rows:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Progress:
+    # Remembers the last row committed by an import so that --resume can pick
+    # up after a crash or Ctrl-C without inserting anything twice. It lives
+    # in the database and save() joins the batch's transaction, so a batch
+    # and its progress are committed together or not at all.
+    def __init__(self, table, path):
+        self.source = f'{table}:{os.path.abspath(path)}'
+
+    def load(self):
+        from .models import ImportProgress
+        progress = ImportProgress.query.get(self.source)
+        return progress.last_row if progress is not None else 0
+
+    def save(self, last_row):
+        from .models import ImportProgress
+        table = ImportProgress.__table__
+        upsert = sqlite_insert(table).values(source=self.source, last_row=last_row)
+        db.session.execute(upsert.on_conflict_do_update(index_elements=[table.c.source],
+                                                        set_={'last_row': last_row}))
+
+    def clear(self):
+        from .models import ImportProgress
+        ImportProgress.query.filter_by(source=self.source).delete()
+        db.session.commit()
+
+
+def blank(value):
+    return value is None or (isinstance(value, str) and value.strip() == '')
+
+
+def required(row, field):
+    value = row.get(field)
+    if blank(value):
+        raise ValueError(f'{field} is required')
+    return str(value).strip()
+
+
+def optional(row, field):
+    value = row.get(field)
+    return None if blank(value) else str(value).strip()
+
+
+def clean_book(row, keep_ids, seller_id):
+    category = required(row, 'category').lower()
+    if category not in VALID_CATEGORIES:
+        raise ValueError(f'unknown category {category!r}')
+
+    price = optional(row, 'price')
+    if price is not None:
+        try:
+            price = float(price)
+        except ValueError:
+            raise ValueError(f'price {price!r} is not a number')
+
+    user_id = optional(row, 'user_id') or seller_id
+    if user_id is None:
+        raise ValueError('user_id is required (or pass --seller)')
+
+    book = {
+        'title': required(row, 'title'),
+        'author': required(row, 'author'),
+        'condition': required(row, 'condition'),
+        'address': optional(row, 'address'),
+        'phone': optional(row, 'phone'),
+        'price': price,
+        'summary': optional(row, 'summary'),
+        'photo': optional(row, 'photo'),
+        'photo_variants': None,
+        'category': category,
+        'user_id': int(user_id),
+    }
+    if keep_ids:
+        book['id'] = int(required(row, 'id'))
+    return book
+
+
+def clean_user(row, keep_ids):
+    # Passwords are expected to be hashes exported from another instance
+    user = {
+        'email': required(row, 'email').lower(),
+        'password': required(row, 'password'),
+        'first_name': optional(row, 'first_name'),
+        'phone': optional(row, 'phone'),
+        'citizenship': optional(row, 'citizenship'),
+        'photo': optional(row, 'photo'),
+        'photo_variants': None,
+    }
+    if keep_ids:
+        user['id'] = int(required(row, 'id'))
+    return user
+
+
+def copy_image(source_dir, filename, dest_dir, variants):
+    # Copy one cover into the upload folder under its content-hash name and
+    # optionally resize it; runs on the import's worker pool
+    source = os.path.join(source_dir, filename)
+    with open(source, 'rb') as f:
+        name = content_hash_name(f, filename.rsplit('.', 1)[-1])
+    dest = os.path.join(dest_dir, name)
+    if not os.path.exists(dest):
+        tmp_path = temp_path(dest)
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, dest)
+    made = ','.join(generate_variants(dest_dir, name)) if variants else None
+    return name, made
+
+
+def check_references(model_name, cleaned, keep_ids):
+    # Reject rows that would break a constraint before inserting, so one bad
+    # row doesn't roll back the rest of its batch
+    User = models()['users']
+    errors = {}
+
+    if keep_ids:
+        model = models()[model_name]
+        ids = [row['id'] for _, row in cleaned]
+        taken = {i for (i,) in db.session.query(model.id).filter(model.id.in_(ids))}
+        seen = set()
+        for number, row in cleaned:
+            if row['id'] in taken or row['id'] in seen:
+                errors[number] = f"id {row['id']} already exists"
+            seen.add(row['id'])
+
+    if model_name == 'books':
+        user_ids = {row['user_id'] for _, row in cleaned}
+        existing = {i for (i,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        for number, row in cleaned:
+            if row['user_id'] not in existing:
+                errors.setdefault(number, f"user {row['user_id']} does not exist")
+    else:
+        emails = [row['email'] for _, row in cleaned]
+        taken = {e for (e,) in db.session.query(User.email).filter(User.email.in_(emails))}
+        seen = set()
+        for number, row in cleaned:
+            if row['email'] in taken or row['email'] in seen:
+                errors.setdefault(number, f"email {row['email']} already exists")
+            seen.add(row['email'])
+
+    return errors
+
+
+@catalogue_cli.command('import')
+@click.argument('table', type=click.Choice(['books', 'users']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--images-from', type=click.Path(exists=True, file_okay=False),
+              help='Directory holding the files named in the photo column.')
+@click.option('--workers', default=4, show_default=True, help='Threads used to copy images.')
+@click.option('--variants/--no-variants', default=True, show_default=True,
+              help='Generate resized variants while copying images.')
+@click.option('--keep-ids', is_flag=True, help='Insert the id column as-is (for migrations).')
+@click.option('--seller', help='Email of the user who owns books without a user_id.')
+@click.option('--resume', is_flag=True, help='Skip rows committed by an earlier run of this import.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: PATH.errors.jsonl).')
+def import_command(table, path, fmt, batch_size, images_from, workers, variants,
+                   keep_ids, seller, resume, errors_path):
+    """Stream a CSV or JSONL file into the books or users table."""
+    from .cache import get_cache
+
+    model = models()[table]
+    fmt = detect_format(path, fmt)
+    progress = Progress(table, path)
+    start_after = progress.load() if resume else 0
+    errors_path = errors_path or path + '.errors.jsonl'
+
+    seller_id = None
+    if seller:
+        seller_user = models()['users'].query.filter_by(email=seller.lower()).first()
+        if seller_user is None:
+            raise click.UsageError(f'No user with email {seller}')
+        seller_id = seller_user.id
+
+    dest_dir = current_app.config['UPLOADED_PHOTOS_DEST']
+    pool = ThreadPoolExecutor(max_workers=workers) if images_from else None
+    imported = rejected = 0
+    categories = set()
+    started = time.perf_counter()
+
+    with open(path, newline='', encoding='utf-8') as fh, \
+            open(errors_path, 'a' if resume else 'w', encoding='utf-8') as error_file:
+
+        def reject(number, message, row):
+            nonlocal rejected
+            rejected += 1
+            error_file.write(json.dumps({'row': number, 'error': message, 'data': row}, default=str) + '\n')
+
+        rows = ((n, r) for n, r in read_rows(fh, fmt) if n > start_after)
+        for batch in batches(rows, batch_size):
+            cleaned = []
+            for number, row in batch:
+                if isinstance(row, Exception):
+                    reject(number, str(row), None)
+                    continue
+                try:
+                    if table == 'books':
+                        cleaned.append((number, clean_book(row, keep_ids, seller_id)))
+                    else:
+                        cleaned.append((number, clean_user(row, keep_ids)))
+                except (ValueError, TypeError) as e:
+                    reject(number, str(e), row)
+
+            errors = check_references(table, cleaned, keep_ids) if cleaned else {}
+            valid = []
+            for number, row in cleaned:
+                if number in errors:
+                    reject(number, errors[number], row)
+                else:
+                    valid.append((number, row))
+
+            if pool is not None:
+                jobs = {number: pool.submit(copy_image, images_from, row['photo'], dest_dir, variants)
+                        for number, row in valid if row['photo']}
+                copied = []
+                for number, row in valid:
+                    if number in jobs:
+                        try:
+                            row['photo'], row['photo_variants'] = jobs[number].result()
+                        except OSError as e:
+                            reject(number, f'image {row["photo"]!r}: {e}', row)
+                            continue
+                    copied.append((number, row))
+                valid = copied
+
+            # One transaction per batch
+            if valid:
+                db.session.execute(insert(model.__table__), [row for _, row in valid])
+                if table == 'books':
+                    facets.record([row for _, row in valid], 1)
+                    categories.update(row['category'] for _, row in valid)
+            progress.save(batch[-1][0])
+            error_file.flush()
+            db.session.commit()
+            imported += len(valid)
+
+    if pool is not None:
+        pool.shutdown()
+    progress.clear()
+    for category in categories:
+        get_cache().invalidate_category(category)
+
+    elapsed = time.perf_counter() - started
+    rate = imported / elapsed if elapsed else 0
+    click.echo(f'Imported {imported} {table} in {elapsed:.1f}s ({rate:,.0f} rows/s); '
+               f'{rejected} rejected.')
+    if rejected:
+        click.echo(f'Rejected rows written to {errors_path}')
+
+
+@catalogue_cli.command('export')
+@click.argument('table', type=click.Choice(['books', 'users']))
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows fetched per query.')
+@click.option('--images-to', type=click.Path(file_okay=False),
+              help='Also copy each row\'s photo into this directory.')
+@click.option('--workers', default=4, show_default=True, help='Threads used to copy images.')
+def export_command(table, path, fmt, chunk_size, images_to, workers):
+    """Stream the books or users table to a CSV or JSONL file."""
+    model = models()[table]
+    fmt = detect_format(path, fmt)
+    columns = [column.name for column in model.__table__.columns]
+    upload_dir = current_app.config['UPLOADED_PHOTOS_DEST']
+    pool = None
+    if images_to:
+        os.makedirs(images_to, exist_ok=True)
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    exported = 0
+    started = time.perf_counter()
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.DictWriter(fh, fieldnames=columns) if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+
+        # Walk the table in primary key order, one chunk at a time
+        last_id = 0
+        while True:
+            chunk = db.session.execute(
+                select(model.__table__)
+                .where(model.__table__.c.id > last_id)
+                .order_by(model.__table__.c.id)
+                .limit(chunk_size)
+            ).mappings().all()
+            if not chunk:
+                break
+
+            copies = []
+            for row in chunk:
+                row = dict(row)
+                if writer:
+                    writer.writerow(row)
+                else:
+                    fh.write(json.dumps(row, default=str) + '\n')
+                if pool is not None and row.get('photo'):
+                    copies.append(pool.submit(
+                        shutil.copyfile,
+                        os.path.join(upload_dir, row['photo']),
+                        os.path.join(images_to, row['photo']),
+                    ))
+            for copy in copies:
+                try:
+                    copy.result()
+                except FileNotFoundError:
+                    pass  # Listing whose photo is missing on disk
+
+            exported += len(chunk)
+            last_id = chunk[-1]['id']
+            # Release the chunk before fetching the next one
+            db.session.expunge_all()
+
+    if pool is not None:
+        pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    rate = exported / elapsed if elapsed else 0
+    click.echo(f'Exported {exported} {table} in {elapsed:.1f}s ({rate:,.0f} rows/s).')
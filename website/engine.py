@@ -0,0 +1,207 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event, inspect, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from . import db
+
+# Per-connection PRAGMAs for each SQLite engine profile. "production" turns on
+# WAL so readers never wait for a writer, waits up to busy_timeout ms for a
+# lock instead of failing with "database is locked", and gives every
+# connection a 64 MB page cache and a 256 MB memory map. "default" leaves
+# SQLite's own settings alone (useful as a baseline for sqlite-bench).
+PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'default': {},
+}
+
+# First migration; databases created by db.create_all() before migrations
+# existed are stamped with it so `flask db upgrade` only applies what's new.
+BASELINE_REVISION = '3f1c2a9d7b40'
+
+
+def include_in_migrations(name, type_, parent_names):
+    # The full-text index and its shadow tables are managed by hand in a
+    # migration, and sqlite_sequence belongs to SQLite's AUTOINCREMENT; keep
+    # autogenerate from trying to drop them
+    return not (type_ == 'table' and (name.startswith('book_fts') or name == 'sqlite_sequence'))
+
+
+def is_file_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config):
+    # SQLALCHEMY_ENGINE_OPTIONS for the configured profile. A file database
+    # gets a QueuePool sized for the app's worker threads; the sqlite3
+    # driver's own lock timeout is kept in step with busy_timeout.
+    options = {}
+    if is_file_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        pragmas = profile_pragmas(config)
+        options.update(
+            # Explicit: SQLAlchemy 1.4 defaults file SQLite to NullPool,
+            # which rejects the sizing arguments below
+            poolclass=QueuePool,
+            pool_size=config.get('SQLITE_POOL_SIZE', 10),
+            max_overflow=config.get('SQLITE_MAX_OVERFLOW', 20),
+            pool_timeout=config.get('SQLITE_POOL_TIMEOUT', 30),
+        )
+        # Pooled connections move between threads; SQLAlchemy 2.0 sets this
+        # for file databases itself, 1.4 leaves pysqlite's same-thread check on
+        options['connect_args'] = {'check_same_thread': False}
+        if 'busy_timeout' in pragmas:
+            options['connect_args']['timeout'] = pragmas['busy_timeout'] / 1000
+    return options
+
+
+def profile_pragmas(config):
+    profile = config.get('SQLITE_PROFILE', 'production')
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown SQLITE_PROFILE: {profile!r}')
+    pragmas = dict(PROFILES[profile])
+    pragmas.update(config.get('SQLITE_PRAGMAS') or {})
+    return pragmas
+
+
+def install_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def init_app(app):
+    # Called inside an app context, once db.init_app() has run
+    install_pragmas(db.engine, profile_pragmas(app.config))
+    app.cli.add_command(sqlite_bench_command)
+
+
+def upgrade_database():
+    # Apply pending migrations, first stamping databases that were made by
+    # create_all() so their existing tables aren't created a second time
+    from flask_migrate import stamp, upgrade
+
+    tables = inspect(db.engine).get_table_names()
+    if 'user' in tables and 'alembic_version' not in tables:
+        stamp(revision=BASELINE_REVISION)
+    upgrade()
+
+
+def _bench_profile(profile, threads, writers, seconds, seed_rows):
+    from .models import Book, User
+
+    config = dict(current_app.config, SQLITE_PROFILE=profile)
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        config['SQLALCHEMY_DATABASE_URI'] = uri
+        config['SQLITE_POOL_SIZE'] = threads
+        engine = create_engine(uri, **engine_options(config))
+        install_pragmas(engine, profile_pragmas(config))
+        db.metadata.create_all(engine)
+
+        book = Book.__table__
+        categories = ['fiction', 'nonfiction', 'abstract']
+        with engine.begin() as conn:
+            conn.execute(insert(User.__table__), [{'email': 'bench@example.com', 'password': 'x'}])
+            conn.execute(insert(book), [
+                {'title': f'Book {i}', 'author': f'Author {i % 500}', 'condition': 'old',
+                 'category': categories[i % 3], 'price': i % 40, 'user_id': 1}
+                for i in range(seed_rows)
+            ])
+
+        counts = {'reads': 0, 'writes': 0, 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def reader():
+            done = 0
+            while time.perf_counter() < deadline:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(book)
+                        .where(book.c.category == random.choice(categories),
+                               book.c.id > random.randint(0, seed_rows))
+                        .order_by(book.c.id)
+                        .limit(24)
+                    ).all()
+                done += 1
+            with lock:
+                counts['reads'] += done
+
+        def writer():
+            done = locked = 0
+            while time.perf_counter() < deadline:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(insert(book), {
+                            'title': 'New listing', 'author': 'Someone', 'condition': 'new',
+                            'category': random.choice(categories), 'user_id': 1,
+                        })
+                    done += 1
+                except OperationalError:
+                    locked += 1
+            with lock:
+                counts['writes'] += done
+                counts['locked'] += locked
+
+        workers = [threading.Thread(target=writer) for _ in range(writers)]
+        workers += [threading.Thread(target=reader) for _ in range(threads - writers)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+
+    return {
+        'profile': profile,
+        'reads_per_s': counts['reads'] / elapsed,
+        'writes_per_s': counts['writes'] / elapsed,
+        'locked_errors': counts['locked'],
+    }
+
+
+@click.command('sqlite-bench')
+@with_appcontext
+@click.option('--threads', default=8, show_default=True, help='Worker threads in total.')
+@click.option('--writers', default=2, show_default=True, help='How many of the threads insert listings.')
+@click.option('--seconds', default=5.0, show_default=True, help='How long each profile runs.')
+@click.option('--rows', 'seed_rows', default=20000, show_default=True, help='Books seeded before the run.')
+@click.option('--profile', 'profiles', multiple=True, type=click.Choice(sorted(PROFILES)),
+              help='Profiles to compare (default: all).')
+def sqlite_bench_command(threads, writers, seconds, seed_rows, profiles):
+    """Measure read/write throughput of the SQLite engine profiles under concurrency.
+
+    Runs against a throwaway database file, never the app's own database.
+    """
+    if not 0 <= writers <= threads:
+        raise click.UsageError('--writers must be between 0 and --threads')
+
+    for profile in profiles or sorted(PROFILES, reverse=True):
+        result = _bench_profile(profile, threads, writers, seconds, seed_rows)
+        click.echo(f"{result['profile']:>10}: {result['reads_per_s']:9,.0f} reads/s "
+                   f"{result['writes_per_s']:8,.0f} writes/s "
+                   f"{result['locked_errors']:5} 'database is locked' errors")
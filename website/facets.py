@@ -0,0 +1,233 @@
+from collections import Counter
+from urllib.parse import urlencode
+
+import click
+from flask import url_for
+from flask.cli import with_appcontext
+from sqlalchemy import and_, bindparam, case, delete, func, insert, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+
+# Facet counts for the category pages live in the book_facet summary table
+# (models.FacetCount), one row per (category, facet, value). Every write that
+# adds or removes books calls record() before committing, so the counts change
+# in the same transaction as the books. `flask rebuild-facets` recomputes the
+# table from scratch if it ever drifts.
+
+# Price buckets as (label, low, high) with low <= price < high; None is open
+PRICE_BUCKETS = (
+    ('under-5', None, 5),
+    ('5-10', 5, 10),
+    ('10-20', 10, 20),
+    ('20-50', 20, 50),
+    ('50-plus', 50, None),
+)
+PRICE_RANGES = {label: (low, high) for label, low, high in PRICE_BUCKETS}
+
+# Query-string parameters view_books filters on
+FILTERS = ('condition', 'price', 'author')
+
+# Authors shown in the facet panel, most listed first
+TOP_AUTHORS = 15
+
+
+def init_app(app):
+    app.add_template_global(facet_url)
+    app.cli.add_command(rebuild_facets_command)
+
+
+def price_bucket(price):
+    if price is None or price == '':
+        return None
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return None
+    for label, low, high in PRICE_BUCKETS:
+        if (low is None or price >= low) and (high is None or price < high):
+            return label
+    return None
+
+
+def facet_keys(book):
+    # The (category, facet, value) rows one book counts towards. Accepts a
+    # Book or a dict of its columns (catalogue import works on dicts).
+    get = book.get if isinstance(book, dict) else lambda field: getattr(book, field)
+    category = get('category')
+    yield category, 'total', ''
+    yield category, 'condition', get('condition')
+    bucket = price_bucket(get('price'))
+    if bucket is not None:
+        yield category, 'price', bucket
+    yield category, 'author', get('author')
+
+
+def record(books, delta):
+    # Add `delta` (1 for new books, -1 for deleted ones) to every count the
+    # books touch. Runs in the caller's transaction; commit afterwards.
+    from .models import FacetCount
+
+    counts = Counter()
+    for book in books:
+        for key in facet_keys(book):
+            counts[key] += delta
+    if not counts:
+        return
+
+    table = FacetCount.__table__
+    rows = [{'category': c, 'facet': f, 'value': v, 'count': n} for (c, f, v), n in counts.items() if n]
+    if not rows:
+        return
+    upsert = sqlite_insert(table)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[table.c.category, table.c.facet, table.c.value],
+        set_={'count': table.c.count + upsert.excluded['count']},
+    )
+    db.session.execute(upsert, rows)
+
+    if delta < 0:
+        # Drop values nobody lists any more so the author facet stays small
+        db.session.execute(
+            delete(table).where(and_(
+                table.c.category == bindparam('c'),
+                table.c.facet == bindparam('f'),
+                table.c.value == bindparam('v'),
+                table.c.count <= 0,
+            )),
+            [{'c': row['category'], 'f': row['facet'], 'v': row['value']} for row in rows],
+        )
+
+
+def delete_books(books):
+    # Delete loaded books by id and take off the counts of only those whose
+    # row this transaction actually removed: a concurrent request or worker
+    # may have deleted some already. Returns the books that were deleted;
+    # they are detached, so their attributes stay readable after the commit.
+    from .models import Book
+
+    table = Book.__table__
+    deleted = []
+    for book in books:
+        if db.session.execute(delete(table).where(table.c.id == book.id)).rowcount:
+            deleted.append(book)
+        db.session.expunge(book)
+    record(deleted, -1)
+    return deleted
+
+
+def rebuild_facets():
+    from .models import Book, FacetCount
+
+    table = FacetCount.__table__
+    book = Book.__table__
+    bucket = case(
+        *[(and_(*([book.c.price >= low] if low is not None else []),
+                *([book.c.price < high] if high is not None else [])), label)
+          for label, low, high in PRICE_BUCKETS],
+    )
+    aggregates = [
+        select(book.c.category, literal('total'), literal(''), func.count())
+        .group_by(book.c.category),
+        select(book.c.category, literal('condition'), book.c.condition, func.count())
+        .group_by(book.c.category, book.c.condition),
+        select(book.c.category, literal('price'), bucket, func.count())
+        .where(book.c.price.isnot(None))
+        .group_by(book.c.category, bucket),
+        select(book.c.category, literal('author'), book.c.author, func.count())
+        .group_by(book.c.category, book.c.author),
+    ]
+
+    db.session.execute(delete(table))
+    for aggregate in aggregates:
+        db.session.execute(insert(table).from_select(['category', 'facet', 'value', 'count'], aggregate))
+    db.session.commit()
+
+
+@click.command('rebuild-facets')
+@with_appcontext
+def rebuild_facets_command():
+    """Recompute the facet counts from the book table."""
+    rebuild_facets()
+    click.echo('Facet counts rebuilt.')
+
+
+def parse_filters(args):
+    # The filters in a request's query string; unknown price buckets are ignored
+    filters = {}
+    for name in FILTERS:
+        value = (args.get(name) or '').strip()
+        if value and (name != 'price' or value in PRICE_RANGES):
+            filters[name] = value
+    return filters
+
+
+def apply_filters(query, filters):
+    from .models import Book
+
+    if 'condition' in filters:
+        query = query.filter(Book.condition == filters['condition'])
+    if 'author' in filters:
+        query = query.filter(Book.author == filters['author'])
+    if 'price' in filters:
+        low, high = PRICE_RANGES[filters['price']]
+        if low is not None:
+            query = query.filter(Book.price >= low)
+        if high is not None:
+            query = query.filter(Book.price < high)
+    return query
+
+
+def filter_key(filters):
+    # Stable, unambiguous cache-key part for a set of filters
+    return urlencode(sorted(filters.items())) or '-'
+
+
+def facet_url(category, filters, name=None, value=None):
+    # Link to the first page of `category` with `name` set to `value`, or
+    # removed when value is None; the other active filters are kept
+    params = dict(filters)
+    if name is not None:
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = value
+    return url_for('auth.view_books', category=category, **params)
+
+
+def facet_panel(category):
+    # Counts for one category page: two primary-key/index range lookups
+    # rather than a GROUP BY over the book table. Counts cover the whole
+    # category, not just the books left after the other filters.
+    from .models import FacetCount
+
+    rows = (FacetCount.query
+            .filter(FacetCount.category == category,
+                    FacetCount.facet.in_(('total', 'condition', 'price')))
+            .all())
+    authors = (FacetCount.query
+               .filter_by(category=category, facet='author')
+               .order_by(FacetCount.count.desc(), FacetCount.value)
+               .limit(TOP_AUTHORS)
+               .all())
+
+    counts = {(row.facet, row.value): row.count for row in rows}
+    return {
+        'total': counts.get(('total', ''), 0),
+        'condition': sorted((value, count) for (facet, value), count in counts.items()
+                            if facet == 'condition'),
+        'price': [(label, counts[('price', label)]) for label, _, _ in PRICE_BUCKETS
+                  if ('price', label) in counts],
+        'author': [(row.value, row.count) for row in authors],
+    }
+
+
+def category_totals(categories):
+    from .models import FacetCount
+
+    rows = FacetCount.query.filter(FacetCount.category.in_(categories),
+                                   FacetCount.facet == 'total',
+                                   FacetCount.value == '')
+    totals = dict.fromkeys(categories, 0)
+    totals.update((row.category, row.count) for row in rows)
+    return totals
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+import bcrypt
+from flask import current_app
+
+
+class HashingBusy(Exception):
+    # Raised when too many hashes are already queued; the caller should ask
+    # the user to try again instead of tying up another worker.
+    pass
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(pw_hash, password):
+    try:
+        return bcrypt.checkpw((password or '').encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash (or a password bcrypt refuses)
+        return False
+
+
+def hash_rounds(pw_hash):
+    # Cost factor of a hash such as "$2b$12$...", or None if it isn't bcrypt
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    # Runs bcrypt on a small, bounded pool so a burst of logins can use at
+    # most `workers` cores. At most `max_pending` hashes may be queued or
+    # running at once; past that, callers get HashingBusy straight away
+    # rather than waiting behind the queue.
+    def __init__(self, rounds=12, workers=2, executor='thread', max_pending=16, timeout=10):
+        self.rounds = rounds
+        self.timeout = timeout
+        if executor == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif executor == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        else:
+            raise ValueError(f'Unknown HASHING_EXECUTOR: {executor!r}')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Optional callback given the seconds each hash took (instrumentation)
+        self.on_timing = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        start = time.perf_counter()
+        try:
+            return self.executor.submit(fn, *args).result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+        finally:
+            self._slots.release()
+            if self.on_timing is not None:
+                self.on_timing(time.perf_counter() - start)
+
+    def hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
+
+
+def init_app(app):
+    app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+    app.config.setdefault('HASHING_EXECUTOR', 'thread')
+    app.config.setdefault('HASHING_WORKERS', 2)
+    app.config.setdefault('HASHING_MAX_PENDING', 16)
+    app.config.setdefault('HASHING_TIMEOUT', 10)
+
+    app.extensions['password_hasher'] = PasswordHasher(
+        rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        workers=app.config['HASHING_WORKERS'],
+        executor=app.config['HASHING_EXECUTOR'],
+        max_pending=app.config['HASHING_MAX_PENDING'],
+        timeout=app.config['HASHING_TIMEOUT'],
+    )
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
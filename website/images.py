@@ -0,0 +1,218 @@
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps, features
+
+from . import db
+from .assets import is_content_addressed
+from .cache import get_cache, invalidate_user
+
+# Resized copies generated for every uploaded photo, keyed by name with the
+# width they are scaled down to (images are never scaled up).
+VARIANT_WIDTHS = {
+    'thumb': 200,
+    'card': 400,
+    'full': 1200,
+}
+
+# Every variant is written as WebP (when Pillow supports it) and as JPEG for
+# browsers that can't display WebP.
+WEBP_ENABLED = features.check('webp')
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_WORKERS', 2)
+    app.config.setdefault('IMAGE_GC_GRACE', 3600)
+    app.extensions['image_pipeline'] = ThreadPoolExecutor(
+        max_workers=app.config['IMAGE_WORKERS'],
+        thread_name_prefix='image-pipeline',
+    )
+    app.add_template_global(image_url)
+    app.add_template_global(image_srcset)
+    app.add_template_global(WEBP_ENABLED, 'webp_enabled')
+
+
+def upload_dir():
+    return current_app.config['UPLOADED_PHOTOS_DEST']
+
+
+def content_hash_name(fh, extension):
+    # Name a file after a hash of its contents, read in chunks
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fh.read(64 * 1024), b''):
+        digest.update(chunk)
+    return f'{digest.hexdigest()[:32]}.{extension.lower()}'
+
+
+def store_upload(file_storage, extension):
+    # Name the file after a hash of its contents: identical uploads are stored
+    # once, and two sellers uploading "cover.jpg" can't overwrite each other.
+    filename = content_hash_name(file_storage.stream, extension)
+    file_storage.stream.seek(0)
+    path = os.path.join(upload_dir(), filename)
+
+    if not os.path.exists(path):
+        # Write to a temporary name first so a half-written file is never served
+        tmp_path = temp_path(path)
+        file_storage.save(tmp_path)
+        os.replace(tmp_path, path)
+    else:
+        # Reused: refresh the mtime so the orphan collector leaves it alone
+        # until the row that points at it has been committed
+        os.utime(path)
+
+    return filename
+
+
+def temp_path(path):
+    # Unique per call, so concurrent writers of the same file never collide
+    return f'{path}.{uuid.uuid4().hex}.tmp'
+
+
+def variant_filename(filename, variant, fmt):
+    stem = filename.rsplit('.', 1)[0]
+    return f'{stem}_{variant}.{fmt}'
+
+
+def variant_formats():
+    return ('webp', 'jpg') if WEBP_ENABLED else ('jpg',)
+
+
+def generate_variants(directory, filename):
+    # Write every missing variant of `filename` and return the variant names
+    # that are available afterwards.
+    with Image.open(os.path.join(directory, filename)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'L'):
+            original = original.convert('RGB')
+
+        for variant, width in VARIANT_WIDTHS.items():
+            resized = None
+            for fmt in variant_formats():
+                path = os.path.join(directory, variant_filename(filename, variant, fmt))
+                if os.path.exists(path):
+                    continue
+                if resized is None:
+                    resized = original.copy()
+                    resized.thumbnail((width, width * 2), Image.LANCZOS)
+                tmp_path = temp_path(path)
+                if fmt == 'webp':
+                    resized.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+                else:
+                    resized.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+
+    return list(VARIANT_WIDTHS)
+
+
+def _process_upload(app, filename):
+    from .models import Book, User
+
+    with app.app_context():
+        try:
+            variants = ','.join(generate_variants(upload_dir(), filename))
+        except (OSError, Image.DecompressionBombError):
+            app.logger.exception('Could not generate image variants for %s', filename)
+            return
+
+        # Identical uploads share a file, so record the variants on every row
+        # that points at it
+        Book.query.filter_by(photo=filename).update({'photo_variants': variants})
+        User.query.filter_by(photo=filename).update({'photo_variants': variants})
+        db.session.commit()
+
+        # Cached listings and users still point at the original photo
+        for (user_id,) in db.session.query(User.id).filter_by(photo=filename):
+            invalidate_user(user_id)
+        categories = db.session.query(Book.category).filter_by(photo=filename).distinct().all()
+        for (category,) in categories:
+            get_cache().invalidate_category(category)
+
+
+def process_in_background(filename):
+    # Hand the resize work to the worker pool so the upload request returns
+    # as soon as the original is on disk
+    app = current_app._get_current_object()
+    return app.extensions['image_pipeline'].submit(_process_upload, app, filename)
+
+
+def release_image(filename):
+    # Delete a photo and its variants once no book or user refers to it.
+    # A file touched within IMAGE_GC_GRACE may belong to a re-upload of the
+    # same bytes whose row isn't committed yet (store_upload refreshes the
+    # mtime), so it is left for collect_orphaned_images.
+    from .models import Book, User
+
+    if not filename:
+        return
+    if Book.query.filter_by(photo=filename).first() or User.query.filter_by(photo=filename).first():
+        return
+    try:
+        if os.path.getmtime(os.path.join(upload_dir(), filename)) > time.time() - current_app.config['IMAGE_GC_GRACE']:
+            return
+    except FileNotFoundError:
+        pass
+
+    names = [filename] + [variant_filename(filename, variant, fmt)
+                          for variant in VARIANT_WIDTHS
+                          for fmt in ('webp', 'jpg')]
+    for name in names:
+        try:
+            os.remove(os.path.join(upload_dir(), name))
+        except FileNotFoundError:
+            pass  # Ignore if the file is not found
+
+
+def collect_orphaned_images(grace_seconds=3600):
+    # Delete uploads and variants that no book or user refers to, and temp
+    # files left behind by a crash. Anything modified in the last
+    # grace_seconds is kept: uploads are written before their row is
+    # committed. The site's own images don't have content-hash names and are
+    # never touched.
+    from .models import Book, User
+
+    referenced = set()
+    for model in (Book, User):
+        for (photo,) in db.session.query(model.photo).filter(model.photo.isnot(None)).distinct():
+            referenced.add(photo.split('.', 1)[0])
+
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    with os.scandir(upload_dir()) as entries:
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                orphaned = True
+            elif is_content_addressed(entry.name):
+                orphaned = entry.name.split('.', 1)[0].split('_', 1)[0] not in referenced
+            else:
+                continue
+            try:
+                if orphaned and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def image_url(filename, variant=None, fmt='jpg', variants=None):
+    # URL of a variant if it has been generated, otherwise of the original
+    if variant and variants and variant in variants.split(','):
+        filename = variant_filename(filename, variant, fmt)
+    return url_for('static', filename='images/' + filename)
+
+
+def image_srcset(filename, variants, fmt='jpg'):
+    if not variants:
+        return ''
+    return ', '.join(
+        f"{url_for('static', filename='images/' + variant_filename(filename, variant, fmt))} {width}w"
+        for variant, width in VARIANT_WIDTHS.items()
+        if variant in variants.split(',')
+    )
@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, before_render_template, g, has_app_context, request, template_rendered
+from sqlalchemy import event
+
+from . import db
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Parts of a request that are timed separately, with their Server-Timing names
+COMPONENTS = ('sql', 'template', 'hash')
+
+
+class Metrics:
+    # Per-process request metrics, rendered in the Prometheus text format.
+    # Each process keeps its own numbers; scrape every worker.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.latency_sum = Counter()
+        self.requests = Counter()
+        self.component_sum = Counter()
+        self.queries = Counter()
+        self.n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, elapsed, timings, query_count, n_plus_one):
+        key = (endpoint, method)
+        with self._lock:
+            counts = self.buckets[key]
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.latency_sum[key] += elapsed
+            self.requests[(endpoint, method, status)] += 1
+            for component, seconds in timings.items():
+                self.component_sum[(endpoint, component)] += seconds
+            self.queries[endpoint] += query_count
+            if n_plus_one:
+                self.n_plus_one[endpoint] += n_plus_one
+
+    def render(self, extra=()):
+        lines = []
+        with self._lock:
+            lines.append('# HELP thriftbook_request_duration_seconds Request latency by endpoint.')
+            lines.append('# TYPE thriftbook_request_duration_seconds histogram')
+            for (endpoint, method), counts in sorted(self.buckets.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'thriftbook_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'thriftbook_request_duration_seconds_sum{{{labels}}} {self.latency_sum[(endpoint, method)]:.6f}')
+                lines.append(f'thriftbook_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+            lines.append('# HELP thriftbook_requests_total Requests by endpoint and status.')
+            lines.append('# TYPE thriftbook_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'thriftbook_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines.append('# HELP thriftbook_request_component_seconds_total Time spent in SQL, templates and password hashing.')
+            lines.append('# TYPE thriftbook_request_component_seconds_total counter')
+            for (endpoint, component), seconds in sorted(self.component_sum.items()):
+                lines.append(f'thriftbook_request_component_seconds_total{{endpoint="{endpoint}",component="{component}"}} {seconds:.6f}')
+
+            lines.append('# HELP thriftbook_sql_queries_total SQL statements executed while serving requests.')
+            lines.append('# TYPE thriftbook_sql_queries_total counter')
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append(f'thriftbook_sql_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines.append('# HELP thriftbook_n_plus_one_total Statements repeated often enough in one request to look like N+1 queries.')
+            lines.append('# TYPE thriftbook_n_plus_one_total counter')
+            for endpoint, count in sorted(self.n_plus_one.items()):
+                lines.append(f'thriftbook_n_plus_one_total{{endpoint="{endpoint}"}} {count}')
+
+        lines.extend(extra)
+        return '\n'.join(lines) + '\n'
+
+
+def record_timing(component, seconds):
+    # Add time to the current request's breakdown; a no-op outside requests
+    # that are being instrumented (CLI commands, worker threads)
+    if has_app_context():
+        timings = g.get('_timings')
+        if timings is not None:
+            timings[component] += seconds
+
+
+def init_app(app):
+    app.config.setdefault('INSTRUMENTATION_ENABLED', False)
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 5)
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        # Nothing is hooked up, so requests pay nothing for it
+        return
+
+    metrics = app.extensions['metrics'] = Metrics()
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+    @app.before_request
+    def start_timer():
+        g._request_start = time.perf_counter()
+        g._timings = dict.fromkeys(COMPONENTS, 0.0)
+        g._statements = Counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('_request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        timings = g._timings
+        statements = g._statements
+        query_count = sum(statements.values())
+        endpoint = request.endpoint or 'unmatched'
+
+        repeated = [(sql, count) for sql, count in statements.items() if count >= threshold]
+        for sql, count in repeated:
+            app.logger.warning('Possible N+1 query in %s: ran %d times: %s', endpoint, count, sql[:200])
+
+        metrics.observe(endpoint, request.method, response.status_code, elapsed,
+                        timings, query_count, len(repeated))
+
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+        parts[0] += f';desc="{query_count} queries"'
+        parts.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers.add('Server-Timing', ', '.join(parts))
+        return response
+
+    engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_start'].pop()
+        if has_app_context():
+            statements = g.get('_statements')
+            if statements is not None:
+                statements[statement] += 1
+                g._timings['sql'] += elapsed
+
+    def start_template(sender, template, context, **extra):
+        g._template_starts = g.get('_template_starts', [])
+        g._template_starts.append(time.perf_counter())
+
+    def end_template(sender, template, context, **extra):
+        starts = g.get('_template_starts')
+        if starts:
+            elapsed = time.perf_counter() - starts.pop()
+            # Count nested renders once, as part of the outermost template
+            if not starts:
+                record_timing('template', elapsed)
+
+    before_render_template.connect(start_template, app, weak=False)
+    template_rendered.connect(end_template, app, weak=False)
+
+    hasher = app.extensions.get('password_hasher')
+    if hasher is not None:
+        hasher.on_timing = lambda seconds: record_timing('hash', seconds)
+
+    def metrics_view():
+        extra = []
+        cache = app.extensions.get('cache')
+        if cache is not None:
+            stats = cache.stats()
+            extra += [
+                '# HELP thriftbook_cache_hits_total Listing cache hits.',
+                '# TYPE thriftbook_cache_hits_total counter',
+                f"thriftbook_cache_hits_total {stats['hits']}",
+                '# HELP thriftbook_cache_misses_total Listing cache misses.',
+                '# TYPE thriftbook_cache_misses_total counter',
+                f"thriftbook_cache_misses_total {stats['misses']}",
+            ]
+        return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
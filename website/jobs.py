@@ -0,0 +1,387 @@
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, delete, func, update
+
+from . import db, facets
+from .cache import get_cache
+from .images import collect_orphaned_images, release_image
+
+# Durable job queue kept in the app database (the `job` table). Requests call
+# enqueue() before they commit, so a job exists if and only if the write that
+# asked for it does. `flask jobs work` runs them: each worker claims one due
+# job at a time with a conditional UPDATE, retries failures with exponential
+# backoff, and puts jobs whose worker died back on the queue once their lease
+# runs out. Handlers may therefore run more than once and must be idempotent.
+
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+# Handler functions by job kind, registered with @handler
+HANDLERS = {}
+
+ACTIVE = ('queued', 'running')
+
+# Settings a `--processes` worker takes from the app the command ran against,
+# so it works on the same database, upload folder and cache as its parent
+WORKER_CONFIG = (
+    'SQLALCHEMY_DATABASE_URI', 'UPLOADED_PHOTOS_DEST', 'UPLOAD_FOLDER',
+    'SQLITE_PROFILE', 'SQLITE_PRAGMAS',
+    'CACHE_BACKEND', 'CACHE_REDIS_URL', 'CACHE_DEFAULT_TTL', 'CACHE_MAX_ENTRIES',
+    'IMAGE_GC_GRACE', 'IMAGE_WORKERS',
+    'JOB_POLL_INTERVAL', 'JOB_LEASE_SECONDS', 'JOB_MAX_ATTEMPTS', 'JOB_RETRY_BASE',
+    'JOB_RETRY_MAX', 'JOB_RETENTION_DAYS', 'JOB_BATCH_SIZE',
+)
+
+
+def init_app(app):
+    app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOB_LEASE_SECONDS', 300)
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOB_RETRY_BASE', 10)
+    app.config.setdefault('JOB_RETRY_MAX', 3600)
+    app.config.setdefault('JOB_RETENTION_DAYS', 7)
+    app.config.setdefault('JOB_BATCH_SIZE', 500)
+    app.cli.add_command(jobs_cli)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, key=None, delay=0, **payload):
+    # Add a job to the caller's transaction; workers see it once the caller
+    # commits. With a key, a matching job that is still queued or running is
+    # returned instead of adding another.
+    from .models import Job
+
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind!r}')
+    if key is not None:
+        existing = Job.query.filter(Job.key == key, Job.status.in_(ACTIVE)).first()
+        if existing is not None:
+            return existing
+
+    now = utcnow()
+    job = Job(
+        kind=kind,
+        key=key,
+        payload=json.dumps(payload),
+        status='queued',
+        attempts=0,
+        max_attempts=current_app.config['JOB_MAX_ATTEMPTS'],
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+    )
+    db.session.add(job)
+    return job
+
+
+def claim(worker):
+    # Take the oldest due job. Several workers may pick the same id; the
+    # UPDATE only matches while it is still queued, so exactly one wins.
+    from .models import Job
+
+    while True:
+        now = utcnow()
+        job_id = (db.session.query(Job.id)
+                  .filter(Job.status == 'queued', Job.run_at <= now)
+                  .order_by(Job.run_at, Job.id)
+                  .limit(1)
+                  .scalar())
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', locked_by=worker, locked_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+
+
+def heartbeat(job):
+    # Extend the lease of a long job; committed with the handler's next batch
+    job.locked_at = utcnow()
+
+
+def backoff(attempts):
+    config = current_app.config
+    delay = min(config['JOB_RETRY_BASE'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX'])
+    # Jitter, so jobs that failed together don't all retry at the same moment
+    return delay * random.uniform(0.9, 1.1)
+
+
+def run_job(job):
+    fn = HANDLERS.get(job.kind)
+    started = time.perf_counter()
+    try:
+        if fn is None:
+            raise LookupError(f'No handler for job kind {job.kind!r}')
+        fn(job, **json.loads(job.payload))
+    except Exception:
+        db.session.rollback()
+        job.last_error = traceback.format_exc()[-4000:]
+        job.locked_by = job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = utcnow()
+            current_app.logger.error('Job %d (%s) failed for good after %d attempts',
+                                     job.id, job.kind, job.attempts)
+        else:
+            job.status = 'queued'
+            job.run_at = utcnow() + timedelta(seconds=backoff(job.attempts))
+            current_app.logger.warning('Job %d (%s) failed on attempt %d, retrying at %s',
+                                       job.id, job.kind, job.attempts, job.run_at)
+        db.session.commit()
+        return False
+
+    job.status = 'done'
+    job.finished_at = utcnow()
+    job.locked_by = job.locked_at = None
+    db.session.commit()
+    current_app.logger.info('Job %d (%s) done in %.2fs', job.id, job.kind, time.perf_counter() - started)
+    return True
+
+
+def sweep():
+    # Requeue jobs whose worker died (or fail them if they're out of
+    # attempts) and drop finished jobs older than JOB_RETENTION_DAYS
+    from .models import Job
+
+    config = current_app.config
+    now = utcnow()
+    expired = now - timedelta(seconds=config['JOB_LEASE_SECONDS'])
+    requeued = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < expired)
+        .values(
+            status=case((Job.attempts >= Job.max_attempts, 'failed'), else_='queued'),
+            locked_by=None,
+            locked_at=None,
+            run_at=now,
+            last_error='Lease expired: the worker running this job stopped.',
+        )
+    ).rowcount
+    db.session.execute(
+        delete(Job).where(Job.status == 'done',
+                          Job.finished_at < now - timedelta(days=config['JOB_RETENTION_DAYS']))
+    )
+    db.session.commit()
+    if requeued:
+        current_app.logger.warning('Requeued %d jobs with expired leases', requeued)
+
+
+def work(worker, burst=False):
+    # Run jobs until SIGINT/SIGTERM (the current job is finished first), or
+    # with burst=True until nothing is due
+    config = current_app.config
+    stopping = []
+    previous = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous[signum] = signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+    try:
+        last_sweep = 0
+        while not stopping:
+            if time.monotonic() - last_sweep > config['JOB_LEASE_SECONDS'] / 2:
+                sweep()
+                last_sweep = time.monotonic()
+
+            job = claim(worker)
+            if job is None:
+                if burst:
+                    break
+                time.sleep(config['JOB_POLL_INTERVAL'])
+                continue
+            run_job(job)
+    finally:
+        for signum, old in previous.items():
+            signal.signal(signum, old)
+
+
+def worker_name(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def _worker_process(index, burst, config):
+    # Entry point of each spawned worker: a fresh interpreter with its own
+    # app and database connections, configured like the parent's app. The
+    # parent has already migrated.
+    from . import create_app
+
+    app = create_app(dict(config, DB_AUTO_UPGRADE=False))
+    with app.app_context():
+        work(worker_name(index), burst)
+
+
+def queue_stats():
+    from .models import Job
+
+    counts = {}
+    for kind, status, count in db.session.query(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status):
+        counts.setdefault(kind, {})[status] = count
+    oldest = db.session.query(func.min(Job.run_at)).filter(Job.status == 'queued', Job.run_at <= utcnow()).scalar()
+    return {
+        'counts': counts,
+        'oldest_due_seconds': round((utcnow() - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
+
+
+@jobs_cli.command('work')
+@click.option('--processes', default=1, show_default=True,
+              help='Worker processes; 1 runs jobs in this process.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due.')
+def work_command(processes, burst):
+    """Run queued jobs until interrupted."""
+    if processes <= 1:
+        work(worker_name(0), burst)
+        return
+
+    config = {key: current_app.config[key] for key in WORKER_CONFIG if key in current_app.config}
+    context = multiprocessing.get_context('spawn')
+    children = [context.Process(target=_worker_process, args=(i, burst, config), name=f'job-worker-{i}')
+                for i in range(processes)]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
+
+
+@jobs_cli.command('status')
+@click.option('--failed', 'show_failed', default=10, show_default=True,
+              help='How many of the most recent failed jobs to show.')
+def status_command(show_failed):
+    """Show job counts by kind and status, and recent failures."""
+    from .models import Job
+
+    stats = queue_stats()
+    if not stats['counts']:
+        click.echo('No jobs.')
+    for kind, counts in sorted(stats['counts'].items()):
+        click.echo(f'{kind:<28} ' + '  '.join(f'{status}={count}' for status, count in sorted(counts.items())))
+    click.echo(f"Oldest due job has waited {stats['oldest_due_seconds']}s.")
+
+    failed = Job.query.filter_by(status='failed').order_by(Job.finished_at.desc()).limit(show_failed).all()
+    for job in failed:
+        error = (job.last_error or '').strip().splitlines()[-1:] or ['']
+        click.echo(f'failed #{job.id} {job.kind} after {job.attempts} attempts: {error[0]}')
+
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', type=int, nargs=-1)
+@click.option('--all-failed', is_flag=True, help='Retry every failed job.')
+def retry_command(job_ids, all_failed):
+    """Put failed jobs back on the queue with their attempts reset."""
+    from .models import Job
+
+    query = Job.query.filter(Job.status == 'failed')
+    if not all_failed:
+        if not job_ids:
+            raise click.UsageError('Pass job ids or --all-failed.')
+        query = query.filter(Job.id.in_(job_ids))
+    count = query.update({'status': 'queued', 'attempts': 0, 'run_at': utcnow(), 'finished_at': None},
+                         synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Requeued {count} jobs.')
+
+
+@jobs_cli.command('collect-images')
+def collect_images_command():
+    """Queue a sweep of the upload folder for images nothing refers to."""
+    job = enqueue('collect_orphaned_images', key='collect_orphaned_images')
+    db.session.commit()
+    click.echo(f'Queued job #{job.id}.')
+
+
+def remove_books(job, condition):
+    # Delete the books matching `condition` one batch per transaction, with
+    # their facet counts. Rows deleted by an earlier attempt simply no longer
+    # match, and rows another worker deletes between our SELECT and DELETE
+    # are not subtracted twice. Returns the photos the books used.
+    from .models import Book
+
+    batch_size = current_app.config['JOB_BATCH_SIZE']
+    photos = set()
+    while True:
+        books = Book.query.filter(condition).order_by(Book.id).limit(batch_size).all()
+        if not books:
+            return photos
+
+        categories = {book.category for book in books}
+        photos.update(book.photo for book in books if book.photo)
+        facets.delete_books(books)
+        heartbeat(job)
+        db.session.commit()
+
+        for category in categories:
+            get_cache().invalidate_category(category)
+
+
+@handler('delete_account')
+def delete_account_job(job, user_id, photo=None):
+    # What a deleted seller left behind: listings, notes and image files
+    from .models import Book, Note
+
+    photos = remove_books(job, Book.user_id == user_id)
+    Note.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+    for filename in photos | {photo}:
+        release_image(filename)
+
+
+@handler('delete_books')
+def delete_books_job(job, user_id, book_ids):
+    # Bulk removal; only the books that still belong to user_id are touched.
+    # The ids come straight from a form, so they are matched JOB_BATCH_SIZE
+    # at a time to stay under SQLite's limit on bound parameters.
+    from .models import Book
+
+    batch_size = current_app.config['JOB_BATCH_SIZE']
+    photos = set()
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        photos |= remove_books(job, and_(Book.id.in_(batch), Book.user_id == user_id))
+    for filename in photos:
+        release_image(filename)
+
+
+@handler('release_images')
+def release_images_job(job, filenames):
+    for filename in filenames:
+        release_image(filename)
+
+
+@handler('collect_orphaned_images')
+def collect_orphaned_images_job(job):
+    removed = collect_orphaned_images(current_app.config['IMAGE_GC_GRACE'])
+    current_app.logger.info('Removed %d orphaned image files', removed)
@@ -0,0 +1,60 @@
+"""initial schema
+
+Revision ID: 3f1c2a9d7b40
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=150), nullable=True),
+    sa.Column('password', sa.String(length=150), nullable=True),
+    sa.Column('first_name', sa.String(length=150), nullable=True),
+    sa.Column('phone', sa.String(length=20), nullable=True),
+    sa.Column('citizenship', sa.String(length=50), nullable=True),
+    sa.Column('photo', sa.String(length=150), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    op.create_table('note',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data', sa.String(length=10000), nullable=True),
+    sa.Column('date', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('book',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('author', sa.String(length=255), nullable=False),
+    sa.Column('condition', sa.String(length=50), nullable=False),
+    sa.Column('address', sa.String(length=255), nullable=True),
+    sa.Column('phone', sa.String(length=20), nullable=True),
+    sa.Column('price', sa.Float(), nullable=True),
+    sa.Column('summary', sa.Text(), nullable=True),
+    sa.Column('photo', sa.String(length=255), nullable=True),
+    sa.Column('cover_image', sa.String(length=255), nullable=True),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('book')
+    op.drop_table('note')
+    op.drop_table('user')
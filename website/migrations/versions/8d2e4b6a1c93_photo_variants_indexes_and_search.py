@@ -0,0 +1,79 @@
+"""photo variants, listing indexes and full-text search
+
+Revision ID: 8d2e4b6a1c93
+Revises: 3f1c2a9d7b40
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b6a1c93'
+down_revision = '3f1c2a9d7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photo_variants', sa.String(length=100), nullable=True))
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photo_variants', sa.String(length=100), nullable=True))
+        batch_op.create_index('ix_book_category_id', ['category', 'id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_note_user_id'), ['user_id'], unique=False)
+
+    # External-content FTS5 index over book, kept in sync by triggers
+    op.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5(
+            title, author, summary,
+            content='book', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS book_fts_insert AFTER INSERT ON book BEGIN
+            INSERT INTO book_fts(rowid, title, author, summary)
+            VALUES (new.id, new.title, new.author, new.summary);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS book_fts_delete AFTER DELETE ON book BEGIN
+            INSERT INTO book_fts(book_fts, rowid, title, author, summary)
+            VALUES ('delete', old.id, old.title, old.author, old.summary);
+        END
+    """)
+    # Only changes to the indexed columns touch the index; the image
+    # pipeline's photo_variants updates don't
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS book_fts_update AFTER UPDATE OF title, author, summary ON book BEGIN
+            INSERT INTO book_fts(book_fts, rowid, title, author, summary)
+            VALUES ('delete', old.id, old.title, old.author, old.summary);
+            INSERT INTO book_fts(rowid, title, author, summary)
+            VALUES (new.id, new.title, new.author, new.summary);
+        END
+    """)
+    op.execute("INSERT INTO book_fts(book_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS book_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS book_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS book_fts_insert")
+    op.execute("DROP TABLE IF EXISTS book_fts")
+
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_note_user_id'))
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_book_user_id'))
+        batch_op.drop_index('ix_book_category_id')
+        batch_op.drop_column('photo_variants')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('photo_variants')
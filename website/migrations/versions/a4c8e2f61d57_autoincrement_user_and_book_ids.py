@@ -0,0 +1,70 @@
+"""never reuse user and book ids
+
+Revision ID: a4c8e2f61d57
+Revises: e7a39b5d0c14
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e2f61d57'
+down_revision = 'e7a39b5d0c14'
+branch_labels = None
+depends_on = None
+
+
+# Rebuilding book drops its triggers; these are the full-text index triggers
+# from 8d2e4b6a1c93
+FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS book_fts_insert AFTER INSERT ON book BEGIN
+        INSERT INTO book_fts(rowid, title, author, summary)
+        VALUES (new.id, new.title, new.author, new.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_fts_delete AFTER DELETE ON book BEGIN
+        INSERT INTO book_fts(book_fts, rowid, title, author, summary)
+        VALUES ('delete', old.id, old.title, old.author, old.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_fts_update AFTER UPDATE OF title, author, summary ON book BEGIN
+        INSERT INTO book_fts(book_fts, rowid, title, author, summary)
+        VALUES ('delete', old.id, old.title, old.author, old.summary);
+        INSERT INTO book_fts(rowid, title, author, summary)
+        VALUES (new.id, new.title, new.author, new.summary);
+    END
+    """,
+)
+
+
+def rebuild(autoincrement):
+    # SQLite can only add or remove AUTOINCREMENT by copying the table; the
+    # copy keeps every id, and sqlite_sequence starts from the highest one
+    for table in ('user', 'book'):
+        with op.batch_alter_table(table, schema=None, recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': autoincrement}):
+            pass
+    for trigger in FTS_TRIGGERS:
+        op.execute(trigger)
+
+
+def upgrade():
+    rebuild(True)
+    # An account deleted before this upgrade may still have listings and
+    # notes waiting for its cleanup job; start past its id too
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'user'")
+    op.execute("""
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'user', MAX(COALESCE((SELECT MAX(id) FROM user), 0),
+                           COALESCE((SELECT MAX(user_id) FROM book), 0),
+                           COALESCE((SELECT MAX(user_id) FROM note), 0))
+    """)
+
+
+def downgrade():
+    rebuild(False)
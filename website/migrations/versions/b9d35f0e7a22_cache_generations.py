@@ -0,0 +1,28 @@
+"""shared listing cache generations
+
+Revision ID: b9d35f0e7a22
+Revises: a4c8e2f61d57
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d35f0e7a22'
+down_revision = 'a4c8e2f61d57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_generation',
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('category')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_generation')
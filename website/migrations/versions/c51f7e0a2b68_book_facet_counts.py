@@ -0,0 +1,71 @@
+"""book facet counts and filter indexes
+
+Revision ID: c51f7e0a2b68
+Revises: 8d2e4b6a1c93
+Create Date: 2026-10-17 13:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51f7e0a2b68'
+down_revision = '8d2e4b6a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('book_facet',
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('facet', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.String(length=255), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('category', 'facet', 'value')
+    )
+    with op.batch_alter_table('book_facet', schema=None) as batch_op:
+        batch_op.create_index('ix_book_facet_top', ['category', 'facet', 'count'], unique=False)
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.create_index('ix_book_category_condition_id', ['category', 'condition', 'id'], unique=False)
+        batch_op.create_index('ix_book_category_author_id', ['category', 'author', 'id'], unique=False)
+
+    # Initial counts for the existing books; afterwards the app keeps them up
+    # to date (and `flask rebuild-facets` recomputes them the same way)
+    op.execute("""
+        INSERT INTO book_facet (category, facet, value, count)
+        SELECT category, 'total', '', COUNT(*) FROM book GROUP BY category
+    """)
+    op.execute("""
+        INSERT INTO book_facet (category, facet, value, count)
+        SELECT category, 'condition', condition, COUNT(*) FROM book GROUP BY category, condition
+    """)
+    op.execute("""
+        INSERT INTO book_facet (category, facet, value, count)
+        SELECT category, 'price', bucket, COUNT(*) FROM (
+            SELECT category,
+                   CASE WHEN price < 5 THEN 'under-5'
+                        WHEN price >= 5 AND price < 10 THEN '5-10'
+                        WHEN price >= 10 AND price < 20 THEN '10-20'
+                        WHEN price >= 20 AND price < 50 THEN '20-50'
+                        WHEN price >= 50 THEN '50-plus'
+                   END AS bucket
+            FROM book WHERE price IS NOT NULL
+        ) GROUP BY category, bucket
+    """)
+    op.execute("""
+        INSERT INTO book_facet (category, facet, value, count)
+        SELECT category, 'author', author, COUNT(*) FROM book GROUP BY category, author
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_index('ix_book_category_author_id')
+        batch_op.drop_index('ix_book_category_condition_id')
+
+    with op.batch_alter_table('book_facet', schema=None) as batch_op:
+        batch_op.drop_index('ix_book_facet_top')
+
+    op.drop_table('book_facet')
@@ -0,0 +1,28 @@
+"""import progress
+
+Revision ID: d62b0f4c9e15
+Revises: b9d35f0e7a22
+Create Date: 2026-10-19 09:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd62b0f4c9e15'
+down_revision = 'b9d35f0e7a22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_progress',
+    sa.Column('source', sa.String(length=1024), nullable=False),
+    sa.Column('last_row', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('import_progress')
@@ -12,7 +12,7 @@ class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column(db.String(10000))
     date = db.Column(db.DateTime(timezone=True), default=func.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
 class User(db.Model, UserMixin):
    
@@ -23,8 +23,13 @@ class User(db.Model, UserMixin):
     phone = db.Column(db.String(20))  # Add this line to include the phone attribute
     citizenship = db.Column(db.String(50))  # Add this line to include the citizenship attribute
     photo = db.Column(db.String(150))  # Add this line to include the photo attribute
+    photo_variants = db.Column(db.String(100))  # Comma-separated resized variants that exist on disk
     notes = db.relationship('Note')
 
+    # Never hand a deleted account's id to a new sign-up: background jobs
+    # still clean up by user_id after the row is gone
+    __table_args__ = {'sqlite_autoincrement': True}
+
 class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(255), nullable=False)
@@ -35,8 +40,80 @@ class Book(db.Model):
     price = db.Column(db.Float)
     summary = db.Column(db.Text)
     photo = db.Column(db.String(255))
+    photo_variants = db.Column(db.String(100))  # Comma-separated resized variants that exist on disk
     cover_image = db.Column(db.String(255)) 
     category = db.Column(db.String(50), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    
-    
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    # Category pages are paginated by (category, id), so keep them together
+    __table_args__ = (
+        db.Index('ix_book_category_id', 'category', 'id'),
+        # Filtered category pages (see facets.py)
+        db.Index('ix_book_category_condition_id', 'category', 'condition', 'id'),
+        db.Index('ix_book_category_author_id', 'category', 'author', 'id'),
+        # Ids of deleted books are never reused (queued jobs refer to them)
+        {'sqlite_autoincrement': True},
+    )
+
+    # Columns needed to render a listing, as plain values that can be cached
+    LISTING_FIELDS = ('id', 'title', 'author', 'condition', 'address', 'phone', 'price',
+                      'summary', 'photo', 'photo_variants', 'category', 'user_id')
+
+    def to_listing(self):
+        return {field: getattr(self, field) for field in self.LISTING_FIELDS}
+
+
+class FacetCount(db.Model):
+    # Number of books per (category, facet, value), kept up to date by
+    # facets.record() in the same transaction as the write that changes it.
+    # facet is 'total' (value ''), 'condition', 'price' (a bucket label) or
+    # 'author'.
+    __tablename__ = 'book_facet'
+    category = db.Column(db.String(50), primary_key=True)
+    facet = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Top values of one facet, e.g. the most listed authors in a category
+    __table_args__ = (
+        db.Index('ix_book_facet_top', 'category', 'facet', 'count'),
+    )
+
+
+class CacheGeneration(db.Model):
+    # Listing cache generation per category, shared by every process (see
+    # cache.DatabaseGenerations)
+    category = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ImportProgress(db.Model):
+    # Last row of a `flask catalogue import` committed so far, written in the
+    # same transaction as that row's batch. source is "<table>:<file path>".
+    __tablename__ = 'import_progress'
+    source = db.Column(db.String(1024), primary_key=True)
+    last_row = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    # Background work queued by jobs.enqueue() and run by `flask jobs work`.
+    # status goes queued -> running -> done, or back to queued with a later
+    # run_at after a failure, and finally failed once max_attempts is used up.
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments for the handler
+    key = db.Column(db.String(150), index=True)  # Identical pending jobs share a key and are queued once
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    # Workers look for the oldest due job with a given status
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
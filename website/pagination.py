@@ -0,0 +1,66 @@
+class KeysetPage:
+    # One page of results plus the cursors needed to reach its neighbours.
+    # A cursor is the id of the last (or first) row shown, so fetching any
+    # page is a single index range scan no matter how deep the user goes.
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def to_dict(self, serialize):
+        return {
+            'items': [serialize(item) for item in self.items],
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['items'], data['next_cursor'], data['prev_cursor'])
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def parse_cursor(value):
+    # Cursors come straight from the query string; anything that isn't a
+    # positive integer is treated as "no cursor" (first page).
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def keyset_paginate(query, column, per_page, after=None, before=None):
+    # Paginate `query` in ascending order of `column` (a unique, indexed
+    # column such as the primary key). Pass `after` to move forward from a
+    # cursor and `before` to move backward. One extra row is fetched to find
+    # out whether there is another page in the direction of travel.
+    def key(row):
+        return getattr(row, column.key)
+
+    if before is not None:
+        rows = (query.filter(column < before)
+                .order_by(column.desc())
+                .limit(per_page + 1)
+                .all())
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        prev_cursor = key(items[0]) if items and has_more else None
+        next_cursor = key(items[-1]) if items else None
+        return KeysetPage(items, next_cursor, prev_cursor)
+
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column.asc()).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = key(items[-1]) if items and has_more else None
+    prev_cursor = key(items[0]) if items and after is not None else None
+    return KeysetPage(items, next_cursor, prev_cursor)
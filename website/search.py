@@ -0,0 +1,74 @@
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from . import db
+
+# External-content FTS5 index over the book table (see the migration that
+# creates it). The index stores only the tokenised text; rows are read back
+# from `book` by rowid. Triggers keep it in sync with every insert, update and
+# delete, whichever code path makes them.
+SEARCH_TABLE = 'book_fts'
+
+# bm25() column weights for title, author and summary
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def init_app(app):
+    # The index and its triggers are created by a migration
+    app.cli.add_command(rebuild_search_index_command)
+
+
+def rebuild_search_index():
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from the book table."""
+    rebuild_search_index()
+    click.echo('Search index rebuilt.')
+
+
+def build_match_query(q):
+    # Turn free text into an FTS5 query: every word must match, and each word
+    # is matched as a prefix so results show up while the user is typing.
+    # Words are quoted so FTS5 operators in user input are taken literally.
+    tokens = TOKEN_RE.findall(q or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_books(q, category=None, page=1, per_page=24):
+    # Returns (books, has_next) for one page of ranked results
+    from .models import Book
+
+    match = build_match_query(q)
+    if not match:
+        return [], False
+
+    weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+    sql = (f"SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE} "
+           f"JOIN book ON book.id = {SEARCH_TABLE}.rowid "
+           f"WHERE {SEARCH_TABLE} MATCH :match")
+    params = {'match': match, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    if category:
+        sql += " AND book.category = :category"
+        params['category'] = category
+    sql += f" ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT :limit OFFSET :offset"
+
+    ids = [row[0] for row in db.session.execute(text(sql), params)]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if not ids:
+        return [], False
+
+    # Load the matching rows and put them back in rank order
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(ids))}
+    return [books[i] for i in ids if i in books], has_next